@@ -7,115 +7,251 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 #
 
+import bisect
+import marshal
+import mmap
 import struct
-import re
 import os
 import os.path
 import sys
-import hashlib
-import datetime
 import time
-import glob
 from collections import namedtuple
 from binascii import unhexlify
+from hashlib import sha256 as _sha256
 
 settings = {}
 
-def hex_switchEndian(s):
-    """ Switches the endianness of a hex string (in pairs of hex chars) """
-    pairList = [s[i:i+2].encode() for i in range(0, len(s), 2)]
-    return b''.join(pairList[::-1]).decode()
+# Number of out-of-order blocks to request read-ahead for at once when
+# catching up
+FETCH_BATCH = 32
 
-def uint32(x):
-    return x & 0xffffffff
+# Distance from the end of an input file at which read-ahead of the next
+# input file is requested
+PREFETCH_NEXT_FILE = 16 * 1024 * 1024
 
-def bytereverse(x):
-    return uint32(( ((x) << 24) | (((x) << 8) & 0x00ff0000) |
-               (((x) >> 8) & 0x0000ff00) | ((x) >> 24) ))
+# Allocation granularity of the out-of-order block cache
+CACHE_CELL = 256
 
-def bufreverse(in_buf):
-    out_words = []
-    for i in range(0, len(in_buf), 4):
-        word = struct.unpack('@I', in_buf[i:i+4])[0]
-        out_words.append(struct.pack('@I', bytereverse(word)))
-    return b''.join(out_words)
-
-def wordreverse(in_buf):
-    out_words = []
-    for i in range(0, len(in_buf), 4):
-        out_words.append(in_buf[i:i+4])
-    out_words.reverse()
-    return b''.join(out_words)
+# Limits on the blocks and bytes collected before writing them out with one
+# writev() call
+WRITE_BATCH = 64
+WRITE_BATCH_SZ = 1024 * 1024
 
+# Headers are hashed on the scanning thread. hashlib only releases the GIL
+# for inputs of a few KiB, so hashing 80-byte headers in a thread pool does
+# not run in parallel and only adds dispatch overhead.
 def calc_hdr_hash(gaia_hdr):
-    hash1 = hashlib.sha256()
-    hash1.update(gaia_hdr)
-    hash1_o = hash1.digest()
-
-    hash2 = hashlib.sha256()
-    hash2.update(hash1_o)
-    hash2_o = hash2.digest()
-
-    return hash2_o
-
-def calc_hash_str(gaia_hdr):
-    hash = calc_hdr_hash(gaia_hdr)
-    hash = bufreverse(hash)
-    hash = wordreverse(hash)
-    hash_str = hash.hex()
-    return hash_str
-
-def get_gaia_dt(gaia_hdr):
-    members = struct.unpack("<I", gaia_hdr[68:68+4])
-    nTime = members[0]
-    dt = datetime.datetime.fromtimestamp(nTime)
-    dt_ym = datetime.datetime(dt.year, dt.month, 1)
-    return (dt_ym, nTime)
-
-# When getting the list of block hashes, undo any byte reversals.
+    return _sha256(_sha256(gaia_hdr).digest()).digest()
+
+def hash_to_str(gaia_hash):
+    # Block hashes are displayed byte-reversed
+    return gaia_hash[::-1].hex()
+
+_unpack_uint32 = struct.Struct("<I").unpack_from
+
+def get_gaia_ts(gaia_hdr):
+    return _unpack_uint32(gaia_hdr, 68)[0]
+
+def month_start_ts(year, month):
+    '''Timestamp of the start of a month in local time. month may be 13.'''
+    return int(time.mktime((year + month // 13, (month - 1) % 12 + 1, 1, 0, 0, 0, 0, 0, -1)))
+
+# Block hashes are kept as raw digests, as returned by calc_hdr_hash(). The
+# hash list has them byte-reversed, unless rev_hash_bytes is set.
 def get_block_hashes(settings):
-    gaiaindex = []
-    f = open(settings['hashlist'], "r", encoding="utf8")
-    for line in f:
-        line = line.rstrip()
+    with open(settings['hashlist'], "r", encoding="utf8") as f:
+        lines = [line.rstrip() for line in f.read().splitlines()]
+    try:
         if settings['rev_hash_bytes'] == 'true':
-            line = hex_switchEndian(line)
-        gaiaindex.append(line)
+            gaiaindex = [bytes.fromhex(line) for line in lines]
+        else:
+            gaiaindex = [bytes.fromhex(line)[::-1] for line in lines]
+    except ValueError:
+        # Only look for the offending line once the fast path has failed
+        for (lineno, line) in enumerate(lines, 1):
+            try:
+                bytes.fromhex(line)
+            except ValueError:
+                print("Invalid block hash on line %i of %s: %r" % (lineno, settings['hashlist'], line))
+                sys.exit(1)
+        raise
 
     print("Read " + str(len(gaiaindex)) + " hashes")
 
     return gaiaindex
 
-# The block map shouldn't give or receive byte-reversed hashes.
+# The block map is keyed by raw block hash digests.
 def mkblockmap(gaiaindex):
-    gaiamap = {}
-    for height,hash in enumerate(gaiaindex):
-        gaiamap[hash] = height
+    return dict(zip(gaiaindex, range(len(gaiaindex))))
+
+# The block map can be cached on disk to skip parsing the hash list on later
+# runs. The cache is only used while the hash list file and the byte order
+# setting are unchanged.
+def blockmap_cache_key(settings):
+    st = os.stat(settings['hashlist'])
+    return (st.st_mtime_ns, st.st_size, settings['rev_hash_bytes'])
+
+def load_blockmap_cache(settings):
+    try:
+        with open(settings['hashlist_cache'], "rb") as f:
+            (key, gaiamap) = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if key != blockmap_cache_key(settings):
+        return None
     return gaiamap
 
+def save_blockmap_cache(settings, gaiamap):
+    # The cache is optional, so failing to write it is not fatal
+    tmpname = settings['hashlist_cache'] + ".tmp"
+    try:
+        with open(tmpname, "wb") as f:
+            marshal.dump((blockmap_cache_key(settings), gaiamap), f)
+        os.replace(tmpname, settings['hashlist_cache'])
+    except OSError as e:
+        print("Warning: could not write block map cache: %s" % e)
+        try:
+            os.remove(tmpname)
+        except OSError:
+            pass
+
 # This gets the first block file ID that exists from the input block
 # file directory.
 def getFirstBlockFileId(block_dir_path):
-    # First, this sets up a pattern to search for block files, for
-    # example 'gaiaNNNNN.dat'.
-    gaiaFilePattern = os.path.join(block_dir_path, "gaia[0-9][0-9][0-9][0-9][0-9].dat")
-
-    # This search is done with glob
-    gaiaFnList = glob.glob(gaiaFilePattern)
-
-    if len(gaiaFnList) == 0:
+    # Block files are named 'gaiaNNNNN.dat'. Collect the IDs of those in the
+    # directory in a single pass over its entries.
+    # A missing directory is treated like one without block files.
+    try:
+        with os.scandir(block_dir_path) as entries:
+            gaiaIds = [int(e.name[4:9]) for e in entries
+                       if len(e.name) == 13 and e.name.startswith('gaia') and
+                       e.name.endswith('.dat') and e.name[4:9].isdigit()]
+    except FileNotFoundError:
+        gaiaIds = []
+
+    if len(gaiaIds) == 0:
         print("blocks not pruned - starting at 0")
         return 0
-    # We then get the lexicographic minimum, which should be the first
-    # block file name.
-    firstBlkFilePath = min(gaiaFnList)
-    firstBlkFn = os.path.basename(firstBlkFilePath)
-
-    # now, the string should be ['b','l','k','N','N','N','N','N','.','d','a','t']
-    # So get the ID by choosing:              3   4   5   6   7
     # The ID is not necessarily 0 if this is a pruned node.
-    gaiaId = int(firstBlkFn[3:8])
-    return gaiaId
+    return min(gaiaIds)
+
+def mapBlockFile(fname):
+    '''Map a block file read-only into memory. Returns None for an empty file.'''
+    with open(fname, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def adviseBlockFile(fname, advice):
+    '''Pass a posix_fadvise() hint for a whole block file.'''
+    try:
+        fd = os.open(fname, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, advice)
+    finally:
+        os.close(fd)
+
+class OutOfOrderCache:
+    '''Fixed-size memory pool for out-of-order block data.
+
+    Blocks are copied into a single buffer allocated up front, in multiples of
+    CACHE_CELL bytes taken first-fit from a sorted list of free regions.
+    Released regions are merged with their free neighbours.
+    '''
+    def __init__(self, size):
+        self.slab = bytearray(size)
+        self.view = memoryview(self.slab)
+        self.free = [(0, size)] if size > 0 else [] # (offset, size) regions, sorted by offset
+        self.entries = {} # height -> (offset, length, allocated size)
+
+    def __contains__(self, height):
+        return height in self.entries
+
+    def put(self, height, buf, start, length):
+        '''Copy buf[start:start+length] into the cache. Returns False if there is no room.'''
+        # A block truncated by the end of its file only has the remaining data
+        length = max(0, min(length, len(buf) - start))
+        need = max(1, -(-length // CACHE_CELL)) * CACHE_CELL
+        for i, (offset, size) in enumerate(self.free):
+            if size >= need:
+                break
+        else:
+            return False
+        if size == need:
+            del self.free[i]
+        else:
+            self.free[i] = (offset + need, size - need)
+        self.view[offset:offset + length] = buf[start:start + length]
+        self.entries[height] = (offset, length, need)
+        return True
+
+    def pop(self, height):
+        '''Remove a block from the cache. The returned view of its data is only
+        valid until the next put().'''
+        (offset, length, need) = self.entries.pop(height)
+        freeOffset, freeSize = offset, need
+        i = bisect.bisect(self.free, (offset,))
+        if i < len(self.free) and self.free[i][0] == offset + need:
+            freeSize += self.free.pop(i)[1]
+        if i > 0 and sum(self.free[i - 1]) == offset:
+            i -= 1
+            freeOffset = self.free[i][0]
+            freeSize += self.free.pop(i)[1]
+        self.free.insert(i, (freeOffset, freeSize))
+        return self.view[offset:offset + length]
+
+class BlockWriter:
+    '''Writes blocks to an output file with batched writev() calls.'''
+    def __init__(self):
+        self.outF = None
+        self.pending = [] # buffers not yet written to outF
+        self.pendingSize = 0
+
+    def open(self, fname):
+        self.outF = os.open(fname, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o666)
+
+    def flush(self):
+        '''Write out the pending buffers with as few system calls as possible'''
+        buffers = self.pending
+        self.pending = []
+        self.pendingSize = 0
+        if buffers and not hasattr(os, 'writev'):
+            buffers = [b''.join(buffers)]
+        while buffers:
+            if hasattr(os, 'writev'):
+                written = os.writev(self.outF, buffers)
+            else:
+                written = os.write(self.outF, buffers[0])
+            # Drop the buffers that were written completely, and the written
+            # part of the next one
+            i = 0
+            while i < len(buffers) and written >= len(buffers[i]):
+                written -= len(buffers[i])
+                i += 1
+            buffers = buffers[i:]
+            if written:
+                buffers[0] = memoryview(buffers[0])[written:]
+
+    def write(self, inhdr, gaia_hdr, rawblock):
+        self.pending += (inhdr, gaia_hdr, rawblock)
+        self.pendingSize += len(inhdr) + len(gaia_hdr) + len(rawblock)
+        if len(self.pending) >= 3 * WRITE_BATCH or self.pendingSize >= WRITE_BATCH_SZ:
+            self.flush()
+
+    def close(self, fname, mtime=None):
+        '''Close the output file, setting its modification time if mtime is given'''
+        # This also runs after a failed write, so the file is always closed.
+        if self.outF is None:
+            return
+        try:
+            self.flush()
+        finally:
+            os.close(self.outF)
+            self.outF = None
+        if mtime is not None:
+            os.utime(fname, (int(time.time()), mtime))
 
 # Block header and extent on disk
 BlockExtent = namedtuple('BlockExtent', ['fn', 'offset', 'inhdr', 'gaiahdr', 'size'])
@@ -129,15 +265,16 @@ class BlockDataCopier:
         # Get first occurring block file id - for pruned nodes this
         # will not necessarily be 0
         self.inFn = getFirstBlockFileId(self.settings['input'])
-        self.inF = None
+        self.inMap = None
+        self.fetchMaps = {} # input files mapped to fetch out-of-order blocks
         self.outFn = 0
         self.outsz = 0
-        self.outF = None
         self.outFname = None
+        self.writer = BlockWriter()
         self.gaiaCountIn = 0
         self.gaiaCountOut = 0
 
-        self.lastDate = datetime.datetime(2000, 1, 1)
+        self.nextMonthTS = month_start_ts(2000, 2)
         self.highTS = 1408893517 - 315360000
         self.timestampSplit = False
         self.fileOutput = True
@@ -151,45 +288,43 @@ class BlockDataCopier:
             self.timestampSplit = True
         # Extents and cache for out-of-order blocks
         self.blockExtents = {}
-        self.outOfOrderData = {}
-        self.outOfOrderSize = 0 # running total size for items in outOfOrderData
+        self.outOfOrderData = OutOfOrderCache(settings['out_of_order_cache_sz'])
+
+    def closeOutFile(self):
+        self.writer.close(self.outFname, self.highTS if self.setFileTime else None)
+        self.outFname = None
+        self.outFn = self.outFn + 1
+        self.outsz = 0
+
+    def finishOutput(self):
+        if self.outFname is not None:
+            self.writer.close(self.outFname)
+            self.outFname = None
 
     def writeBlock(self, inhdr, gaia_hdr, rawblock):
         blockSizeOnDisk = len(inhdr) + len(gaia_hdr) + len(rawblock)
         if not self.fileOutput and ((self.outsz + blockSizeOnDisk) > self.maxOutSz):
-            self.outF.close()
-            if self.setFileTime:
-                os.utime(self.outFname, (int(time.time()), self.highTS))
-            self.outF = None
-            self.outFname = None
-            self.outFn = self.outFn + 1
-            self.outsz = 0
-
-        (gaiaDate, gaiaTS) = get_gaia_dt(gaia_hdr)
-        if self.timestampSplit and (gaiaDate > self.lastDate):
-            print("New month " + gaiaDate.strftime("%Y-%m") + " @ " + self.hash_str)
-            self.lastDate = gaiaDate
-            if self.outF:
-                self.outF.close()
-                if self.setFileTime:
-                    os.utime(self.outFname, (int(time.time()), self.highTS))
-                self.outF = None
-                self.outFname = None
-                self.outFn = self.outFn + 1
-                self.outsz = 0
-
-        if not self.outF:
+            self.closeOutFile()
+
+        gaiaTS = get_gaia_ts(gaia_hdr)
+        if self.timestampSplit and gaiaTS >= self.nextMonthTS:
+            # Only convert the timestamp to a date when a new month starts
+            gaiaMonth = time.localtime(gaiaTS)[:2]
+            print("New month %04d-%02d @ " % gaiaMonth + hash_to_str(self.gaiaHash))
+            self.nextMonthTS = month_start_ts(gaiaMonth[0], gaiaMonth[1] + 1)
+            if self.outFname is not None:
+                self.closeOutFile()
+
+        if self.outFname is None:
             if self.fileOutput:
                 self.outFname = self.settings['output_file']
             else:
                 self.outFname = os.path.join(self.settings['output'], "gaia%05d.dat" % self.outFn)
             print("Output file " + self.outFname)
-            self.outF = open(self.outFname, "wb")
+            self.writer.open(self.outFname)
 
-        self.outF.write(inhdr)
-        self.outF.write(gaia_hdr)
-        self.outF.write(rawblock)
-        self.outsz = self.outsz + len(inhdr) + len(gaia_hdr) + len(rawblock)
+        self.writer.write(inhdr, gaia_hdr, rawblock)
+        self.outsz = self.outsz + blockSizeOnDisk
 
         self.gaiaCountOut = self.gaiaCountOut + 1
         if gaiaTS > self.highTS:
@@ -202,107 +337,192 @@ class BlockDataCopier:
     def inFileName(self, fn):
         return os.path.join(self.settings['input'], "gaia%05d.dat" % fn)
 
+    def getInputMap(self, fn):
+        '''Get a mapping of an input file, keeping it open until closeFetchMaps()'''
+        if fn == self.inFn and self.inMap:
+            return self.inMap
+        if fn not in self.fetchMaps:
+            self.fetchMaps[fn] = mapBlockFile(self.inFileName(fn))
+        return self.fetchMaps[fn]
+
+    def closeFetchMaps(self):
+        for inMap in self.fetchMaps.values():
+            inMap.close()
+        self.fetchMaps = {}
+
+    def prefetchBlocks(self, count):
+        '''Ask the kernel to start reading the next uncached out-of-order blocks'''
+        if not hasattr(mmap, 'MADV_WILLNEED'):
+            return
+        for height in range(self.gaiaCountOut, self.gaiaCountOut + count):
+            extent = self.blockExtents.get(height)
+            if extent is None:
+                break
+            if height in self.outOfOrderData:
+                continue
+            inMap = self.getInputMap(extent.fn)
+            start = extent.offset - extent.offset % mmap.PAGESIZE
+            end = min(extent.offset + extent.size, len(inMap))
+            if end > start:
+                inMap.madvise(mmap.MADV_WILLNEED, start, end - start)
+
     def fetchBlock(self, extent):
         '''Fetch block contents from disk given extents'''
-        with open(self.inFileName(extent.fn), "rb") as f:
-            f.seek(extent.offset)
-            return f.read(extent.size)
+        inMap = self.getInputMap(extent.fn)
+        return inMap[extent.offset:extent.offset + extent.size]
 
     def copyOneBlock(self):
-        '''Find the next block to be written in the input, and copy it to the output.'''
+        '''Find the next block to be written in the input, and copy it to the output.
+        Returns True if the data came from the out-of-order cache.'''
         extent = self.blockExtents.pop(self.gaiaCountOut)
-        if self.gaiaCountOut in self.outOfOrderData:
+        cached = self.gaiaCountOut in self.outOfOrderData
+        if cached:
             # If the data is cached, use it from memory and remove from the cache
             rawblock = self.outOfOrderData.pop(self.gaiaCountOut)
-            self.outOfOrderSize -= len(rawblock)
         else: # Otherwise look up data on disk
             rawblock = self.fetchBlock(extent)
 
         self.writeBlock(extent.inhdr, extent.gaiahdr, rawblock)
+        return cached
 
     def run(self):
-        while self.gaiaCountOut < len(self.gaiaindex):
-            if not self.inF:
+        try:
+            complete = self.copyBlocks()
+        finally:
+            # Also on errors, so that the output file is trimmed
+            self.finishOutput()
+        if complete:
+            print("Done (%i blocks written)" % (self.gaiaCountOut))
+
+    def copyBlocks(self):
+        '''Scan the input files and copy blocks in order. Returns False if the
+        input ends before all blocks were found.'''
+        # Bind settings and state used on every block to locals, which are
+        # cheaper to look up than attributes and dict items
+        netmagic = self.settings['netmagic']
+        debugOutput = self.settings['debug_output'] == 'true'
+        gaiamap = self.gaiamap
+        blockExtents = self.blockExtents
+        outOfOrderData = self.outOfOrderData
+        writeBlock = self.writeBlock
+        unpack_uint32 = _unpack_uint32
+        numBlocks = len(self.gaiaindex)
+        inMap = self.inMap
+        inPos = 0
+        nextPrefetched = False
+
+        while self.gaiaCountOut < numBlocks:
+            if not inMap:
                 fname = self.inFileName(self.inFn)
                 print("Input file " + fname)
                 try:
-                    self.inF = open(fname, "rb")
+                    inMap = self.inMap = mapBlockFile(fname)
                 except IOError:
                     print("Premature end of block data")
-                    return
-
-            inhdr = self.inF.read(8)
-            if (not inhdr or (inhdr[0] == "\0")):
-                self.inF.close()
-                self.inF = None
+                    return False
+                inPos = 0
+                nextPrefetched = False
+                if not inMap:
+                    self.inFn = self.inFn + 1
+                    continue
+                inSize = len(inMap)
+                if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                    inMap.madvise(mmap.MADV_SEQUENTIAL)
+
+            # Search forward for the next magic bytes, skipping any padding or
+            # garbage in between.
+            inPos = inMap.find(netmagic, inPos)
+            if inPos < 0 or inPos + 8 > inSize:
+                inMap.close()
+                inMap = self.inMap = None
+                # Done with this file, its pages need not stay cached unless
+                # out-of-order blocks that did not fit in the cache will still
+                # be fetched from it
+                if hasattr(os, 'POSIX_FADV_DONTNEED') and not any(
+                        extent.fn == self.inFn and height not in outOfOrderData
+                        for (height, extent) in blockExtents.items()):
+                    adviseBlockFile(self.inFileName(self.inFn), os.POSIX_FADV_DONTNEED)
                 self.inFn = self.inFn + 1
                 continue
 
-            inMagic = inhdr[:4]
-            if (inMagic != self.settings['netmagic']):
-                # Seek backwards 7 bytes (skipping the first byte in the previous search)
-                # and continue searching from the new position if the magic bytes are not
-                # found.
-                self.inF.seek(-7, os.SEEK_CUR)
-                continue
-            inLenLE = inhdr[4:]
-            su = struct.unpack("<I", inLenLE)
-            inLen = su[0] - 80 # length without header
-            gaia_hdr = self.inF.read(80)
-            inExtent = BlockExtent(self.inFn, self.inF.tell(), inhdr, gaia_hdr, inLen)
-
-            self.hash_str = calc_hash_str(gaia_hdr)
-            if not self.hash_str in gaiamap:
+            if not nextPrefetched and inPos >= inSize - PREFETCH_NEXT_FILE:
+                # Nearing the end of this file, start reading the next one in
+                # the background
+                if hasattr(os, 'POSIX_FADV_WILLNEED'):
+                    adviseBlockFile(self.inFileName(self.inFn + 1), os.POSIX_FADV_WILLNEED)
+                nextPrefetched = True
+
+            inLen = unpack_uint32(inMap, inPos + 4)[0] - 80 # length without header
+            gaia_hdr = inMap[inPos + 8:inPos + 88]
+            hdrPos = inPos
+            inPos += 88
+
+            self.gaiaHash = calc_hdr_hash(gaia_hdr)
+            gaiaHeight = gaiamap.get(self.gaiaHash)
+            if gaiaHeight is None:
                 # Because blocks can be written to files out-of-order as of 0.10, the script
                 # may encounter blocks it doesn't know about. Treat as debug output.
-                if settings['debug_output'] == 'true':
-                    print("Skipping unknown block " + self.hash_str)
-                self.inF.seek(inLen, os.SEEK_CUR)
+                if debugOutput:
+                    print("Skipping unknown block " + hash_to_str(self.gaiaHash))
+                inPos += inLen
                 continue
 
-            gaiaHeight = self.gaiamap[self.hash_str]
             self.gaiaCountIn += 1
+            inhdr = inMap[hdrPos:hdrPos + 8]
 
             if self.gaiaCountOut == gaiaHeight:
                 # If in-order block, just copy
-                rawblock = self.inF.read(inLen)
-                self.writeBlock(inhdr, gaia_hdr, rawblock)
-
-                # See if we can catch up to prior out-of-order blocks
-                while self.gaiaCountOut in self.blockExtents:
-                    self.copyOneBlock()
+                rawblock = inMap[inPos:inPos + inLen]
+                inPos += inLen
+                writeBlock(inhdr, gaia_hdr, rawblock)
+
+                # See if we can catch up to prior out-of-order blocks. Read-ahead
+                # is requested for a batch of them at a time so the disk can
+                # service the reads concurrently.
+                caughtUp = 0
+                usedCache = False
+                while self.gaiaCountOut in blockExtents:
+                    if caughtUp % FETCH_BATCH == 0:
+                        self.prefetchBlocks(FETCH_BATCH)
+                    if self.copyOneBlock():
+                        usedCache = True
+                    caughtUp += 1
+                self.closeFetchMaps()
+                if usedCache:
+                    # Pending writes may refer to out-of-order cache memory
+                    # that gets reused as soon as another block is cached
+                    self.writer.flush()
 
             else: # If out-of-order, skip over block data for now
-                self.blockExtents[gaiaHeight] = inExtent
-                if self.outOfOrderSize < self.settings['out_of_order_cache_sz']:
-                    # If there is space in the cache, read the data
-                    # Reading the data in file sequence instead of seeking and fetching it later is preferred,
-                    # but we don't want to fill up memory
-                    self.outOfOrderData[gaiaHeight] = self.inF.read(inLen)
-                    self.outOfOrderSize += inLen
-                else: # If no space in cache, seek forward
-                    self.inF.seek(inLen, os.SEEK_CUR)
-
-        print("Done (%i blocks written)" % (self.gaiaCountOut))
+                blockExtents[gaiaHeight] = BlockExtent(self.inFn, inPos, inhdr, gaia_hdr, inLen)
+                # If there is space in the cache, read the data
+                # Reading the data in file sequence instead of seeking and fetching it later is preferred,
+                # but we don't want to fill up memory
+                outOfOrderData.put(gaiaHeight, inMap, inPos, inLen)
+                # Skip over the block data
+                inPos += inLen
+
+        return True
 
 if __name__ == '__main__':
     if len(sys.argv) != 2:
         print("Usage: linearize-data.py CONFIG-FILE")
         sys.exit(1)
 
-    f = open(sys.argv[1], encoding="utf8")
-    for line in f:
-        # skip comment lines
-        m = re.search(r'^\s*#', line)
-        if m:
-            continue
+    with open(sys.argv[1], encoding="utf8") as f:
+        for line in f:
+            # skip blank and comment lines
+            line = line.strip()
+            if not line or line[0] == '#':
+                continue
 
-        # parse key=value lines
-        m = re.search(r'^(\w+)\s*=\s*(\S.*)$', line)
-        if m is None:
-            continue
-        settings[m.group(1)] = m.group(2)
-    f.close()
+            # parse key=value lines
+            (key, sep, value) = line.partition('=')
+            key = key.strip()
+            value = value.strip()
+            if not sep or not key or not value:
+                continue
+            settings[key] = value
 
     # Force hash byte format setting to be lowercase to make comparisons easier.
     # Also place upfront in case any settings need to know about it.
@@ -340,11 +560,21 @@ if __name__ == '__main__':
         print("Missing output file / directory")
         sys.exit(1)
 
-    gaiaindex = get_block_hashes(settings)
-    gaiamap = mkblockmap(gaiaindex)
+    gaiamap = None
+    if 'hashlist_cache' in settings:
+        gaiamap = load_blockmap_cache(settings)
+    if gaiamap is None:
+        gaiaindex = get_block_hashes(settings)
+        gaiamap = mkblockmap(gaiaindex)
+        if 'hashlist_cache' in settings:
+            save_blockmap_cache(settings, gaiamap)
+    else:
+        # The map was built in height order, so its keys are the hash list
+        gaiaindex = list(gaiamap)
+        print("Read " + str(len(gaiaindex)) + " hashes from " + settings['hashlist_cache'])
 
-    # Block hash map won't be byte-reversed. Neither should the genesis hash.
-    if not settings['genesis'] in gaiamap:
+    # The genesis hash setting is byte-reversed, like getblockhash output.
+    if not bytes.fromhex(settings['genesis'])[::-1] in gaiamap:
         print("Genesis block not found in hashlist")
     else:
         BlockDataCopier(settings, gaiaindex, gaiamap).run()
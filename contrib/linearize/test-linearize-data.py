@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+'''
+Test script for linearize-data.py
+'''
+import hashlib
+import importlib.util
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'linearize-data.py')
+NETMAGIC = bytes.fromhex('fbc0b6db')
+
+spec = importlib.util.spec_from_file_location('linearize_data', SCRIPT)
+linearize_data = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(linearize_data)
+
+def make_block(height, size):
+    '''Return (block hash, on-disk record) for a dummy block'''
+    gaia_hdr = struct.pack('<I', 1) + bytes(64) + struct.pack('<III', 1500000000 + height, 0, height)
+    rawblock = bytes([height + 1]) * size
+    gaia_hash = hashlib.sha256(hashlib.sha256(gaia_hdr).digest()).digest()
+    return (gaia_hash, NETMAGIC + struct.pack('<I', 80 + size) + gaia_hdr + rawblock)
+
+class TestOutOfOrderCache(unittest.TestCase):
+    def test_short_buffer(self):
+        cache = linearize_data.OutOfOrderCache(4096)
+        buf = bytes(range(100))
+        # Only 40 bytes are left in buf past offset 60
+        self.assertTrue(cache.put(1, buf, 60, 200))
+        self.assertEqual(bytes(cache.pop(1)), buf[60:])
+        self.assertEqual(cache.free, [(0, 4096)])
+
+class TestBlockMapCache(unittest.TestCase):
+    def test_cache_cycle(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            settings = {
+                'hashlist': os.path.join(tmpdir, 'hashlist.txt'),
+                'hashlist_cache': os.path.join(tmpdir, 'hashlist.cache'),
+                'rev_hash_bytes': 'false',
+            }
+            with open(settings['hashlist'], 'w', encoding='utf8') as f:
+                f.write('00' * 31 + '01\n' + '00' * 31 + '02\n')
+            gaiamap = linearize_data.mkblockmap(linearize_data.get_block_hashes(settings))
+            # Nothing cached yet
+            self.assertIsNone(linearize_data.load_blockmap_cache(settings))
+            linearize_data.save_blockmap_cache(settings, gaiamap)
+            self.assertEqual(linearize_data.load_blockmap_cache(settings), gaiamap)
+            # Changing the byte order setting invalidates the cache
+            settings['rev_hash_bytes'] = 'true'
+            self.assertIsNone(linearize_data.load_blockmap_cache(settings))
+            settings['rev_hash_bytes'] = 'false'
+            # So does touching the hash list
+            st = os.stat(settings['hashlist'])
+            os.utime(settings['hashlist'], ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+            self.assertIsNone(linearize_data.load_blockmap_cache(settings))
+            linearize_data.save_blockmap_cache(settings, gaiamap)
+            self.assertEqual(linearize_data.load_blockmap_cache(settings), gaiamap)
+            # A corrupt or empty cache file is ignored
+            for data in (b'garbage', b''):
+                with open(settings['hashlist_cache'], 'wb') as f:
+                    f.write(data)
+                self.assertIsNone(linearize_data.load_blockmap_cache(settings))
+
+    def test_unwritable_cache(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            settings = {
+                'hashlist': os.path.join(tmpdir, 'hashlist.txt'),
+                'hashlist_cache': os.path.join(tmpdir, 'hashlist.cache'),
+                'rev_hash_bytes': 'false',
+            }
+            with open(settings['hashlist'], 'w', encoding='utf8') as f:
+                f.write('00' * 32 + '\n')
+            # A directory in the way makes the final rename fail, which only warns
+            os.mkdir(settings['hashlist_cache'])
+            linearize_data.save_blockmap_cache(settings, {})
+            self.assertFalse(os.path.exists(settings['hashlist_cache'] + '.tmp'))
+            self.assertIsNone(linearize_data.load_blockmap_cache(settings))
+
+def write_chain(tmpdir, files, blocks, output):
+    '''Write block files, a hash list and a config file, returning the config path'''
+    os.mkdir(os.path.join(tmpdir, 'blocks'))
+    for (fn, data) in enumerate(files):
+        with open(os.path.join(tmpdir, 'blocks', 'gaia%05d.dat' % fn), 'wb') as f:
+            f.write(data)
+    with open(os.path.join(tmpdir, 'hashlist.txt'), 'w', encoding='utf8') as f:
+        f.write(''.join(gaia_hash[::-1].hex() + '\n' for (gaia_hash, _) in blocks))
+    config = os.path.join(tmpdir, 'linearize.cfg')
+    with open(config, 'w', encoding='utf8') as f:
+        f.write('netmagic=%s\n' % NETMAGIC.hex())
+        f.write('genesis=%s\n' % blocks[0][0][::-1].hex())
+        f.write('input=%s\n' % os.path.join(tmpdir, 'blocks'))
+        f.write('hashlist=%s\n' % os.path.join(tmpdir, 'hashlist.txt'))
+        f.write('output_file=%s\n' % output)
+    return config
+
+def run_linearize(config):
+    return subprocess.run([sys.executable, SCRIPT, config], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+class TestLinearizeData(unittest.TestCase):
+    def test_invalid_hashlist(self):
+        blocks = [make_block(height, 1000) for height in range(3)]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config = write_chain(tmpdir, [b''.join(record for (_, record) in blocks)], blocks, os.devnull)
+            with open(os.path.join(tmpdir, 'hashlist.txt'), 'a', encoding='utf8') as f:
+                f.write('not a hash\n')
+            p = run_linearize(config)
+            self.assertEqual(p.returncode, 1)
+            self.assertIn('Invalid block hash on line 4 of', p.stdout)
+            self.assertNotIn('Traceback', p.stderr)
+
+    def test_truncated_out_of_order_block(self):
+        blocks = [make_block(height, 1000) for height in range(3)]
+        # Block 1 comes first and is cut off by the end of its file
+        truncated = blocks[1][1][:-300]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = os.path.join(tmpdir, 'bootstrap.dat')
+            config = write_chain(tmpdir, [truncated, blocks[0][1] + blocks[2][1]], blocks, output)
+            p = run_linearize(config)
+            self.assertEqual(p.returncode, 0, p.stderr)
+            self.assertIn('Done (3 blocks written)', p.stdout)
+            with open(output, 'rb') as f:
+                self.assertEqual(f.read(), blocks[0][1] + truncated + blocks[2][1])
+
+    def test_output_not_a_regular_file(self):
+        blocks = [make_block(height, 1000) for height in range(3)]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config = write_chain(tmpdir, [blocks[1][1] + blocks[0][1] + blocks[2][1]], blocks, os.devnull)
+            p = run_linearize(config)
+            self.assertEqual(p.returncode, 0, p.stderr)
+            self.assertIn('Done (3 blocks written)', p.stdout)
+
+    @unittest.skipUnless(hasattr(os, 'mkfifo'), 'needs os.mkfifo')
+    def test_output_fifo(self):
+        blocks = [make_block(height, 100000) for height in range(30)]
+        order = [1, 0, 3, 2] + list(range(4, 30))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fifo = os.path.join(tmpdir, 'bootstrap.fifo')
+            os.mkfifo(fifo)
+            config = write_chain(tmpdir, [b''.join(blocks[i][1] for i in order)], blocks, fifo)
+            received = []
+            def read_fifo():
+                with open(fifo, 'rb') as f:
+                    received.append(f.read())
+            reader = threading.Thread(target=read_fifo)
+            reader.start()
+            p = run_linearize(config)
+            reader.join()
+            self.assertEqual(p.returncode, 0, p.stderr)
+            self.assertEqual(received[0], b''.join(record for (_, record) in blocks))
+
+if __name__ == '__main__':
+    unittest.main()